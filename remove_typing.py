@@ -1,7 +1,12 @@
 import ast
-import astunparse
 
-source = "".join(open("work.py").readlines())
+try:
+    from ast import unparse
+except ImportError:  # python < 3.9
+    from astunparse import unparse
+
+with open("work.py") as reader:
+    source = reader.read()
 
 
 class TypeHintRemover(ast.NodeTransformer):
@@ -29,8 +34,7 @@ parsed_source = ast.parse(source)
 # and import statements from 'typing'
 transformed = TypeHintRemover().visit(parsed_source)
 # convert the AST back to source code
-result = astunparse.unparse(transformed)
+result = unparse(transformed)
 
-writer = open('tableau.py', "w")
-writer.write(result)
-writer.close()
\ No newline at end of file
+with open('tableau.py', "w") as writer:
+    writer.write(result)
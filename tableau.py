@@ -2,6 +2,17 @@
 # note: python 3.6.8 does not have | operator for types yet
 debugFlag = False
 
+# token alphabets of the input language
+_PROP_CHARS = frozenset(('p', 'q', 'r', 's'))
+_VAR_CHARS = frozenset(('x', 'y', 'z', 'w'))
+_PRED_CHARS = frozenset(('P', 'Q', 'R', 'S'))
+
+# flyweight pool of the leaf symbols (propositions, variables, constants), keyed by (class, name)
+_SYM_CACHE = {}
+# hash-consing pool of predicates and formulas, keyed by their class and their (interned) parts;
+# it only lives for one input line (see parse), and pins the nodes, so their ids stay valid meanwhile
+_NODE_CACHE = {}
+
 
 class FormulaSymbol:
     And = "^"
@@ -12,8 +23,29 @@ class FormulaSymbol:
     All = "A"
 
 
+class TokenKind:
+    PROP = 0
+    NOT = 1
+    OPEN = 2
+    PRED = 3
+    EXIST = 4
+    ALL = 5
+
+
+# the tableau rule which expands a formula, read from the class of the formula
+class TableauRule:
+    NONE = 0
+    LITERAL = 1
+    ALPHA = 2
+    BETA = 3
+    DELTA = 4
+    GAMMA = 5
+
+
 class Symbol:
+    __slots__ = ('name',)
     name: str
+    rule = TableauRule.NONE
 
     def __init__(self, name):
         self.name = name
@@ -21,43 +53,75 @@ class Symbol:
     def __str__(self):
         return self.name
 
+    # leaf symbols are interned, so identity is equality
     def __eq__(self, other):
-        return self.name == other.name
+        return self is other
+
+    __hash__ = object.__hash__
+
+    @classmethod
+    def _intern(cls, name):
+        key = (cls, name)
+        sym = _SYM_CACHE.get(key)
+        if sym is None:
+            sym = object.__new__(cls)
+            sym.name = name
+            _SYM_CACHE[key] = sym
+        return sym
 
     def substitute(self, var, const):
         return self
 
-    def isPrimary(self):
-        return isinstance(self, Proposition) or isinstance(self, Predicate)
 
-    def isSymbol(self):
-        return self.isPrimary() or (isinstance(self, NotFormula) and self.getLeft().isPrimary())
+class Proposition(Symbol):
+    __slots__ = ()
+    rule = TableauRule.LITERAL
 
+    def __new__(cls, name):
+        return cls._intern(name)
 
-class Proposition(Symbol):
     def __init__(self, name):
         super().__init__(name)
 
     @staticmethod
     def isProp(c: str):
-        return c == 'p' or c == 'q' or c == 'r' or c == 's'
+        return c in _PROP_CHARS
 
 
 class Variable(Symbol):
+    __slots__ = ()
+
+    def __new__(cls, name):
+        return cls._intern(name)
+
     def __init__(self, name):
         super().__init__(name)
 
     @staticmethod
     def isVar(c: str):
-        return c == 'x' or c == 'y' or c == 'z' or c == 'w'
+        return c in _VAR_CHARS
 
 
 class Constant(Symbol):
+    __slots__ = ()
+
+    def __new__(cls, name):
+        return cls._intern(name)
+
     def __init__(self, name):
         super().__init__(name)
 
 
+# the propositions and variables of the input alphabet, built once and returned by the parser
+_PROPS = {c: Proposition(c) for c in _PROP_CHARS}
+_VARS = {c: Variable(c) for c in _VAR_CHARS}
+# the constants a proof may introduce, 'a' to 'j'
+_CONSTS = tuple(Constant(chr(ord('a') + i)) for i in range(10))
+
+
 class Predicate(Symbol):
+    __slots__ = ('_leftVar', '_rightVar', '_hash')
+    rule = TableauRule.LITERAL
     _leftVar: Symbol
     _rightVar: Symbol
 
@@ -65,10 +129,11 @@ class Predicate(Symbol):
         super().__init__(name)
         self._leftVar = left
         self._rightVar = right
+        self._hash = hash((name, left, right))
 
     @staticmethod
     def isPredChar(c: str):
-        return c == 'P' or c == 'Q' or c == 'R' or c == 'S'
+        return c in _PRED_CHARS
 
     def getLeftVar(self):
         return self._leftVar
@@ -83,136 +148,184 @@ class Predicate(Symbol):
             left = c
         if self._rightVar == v:
             right = c
-        return Predicate(self.name, left, right)
+        return Predicate.make(self.name, left, right)
+
+    # the shared predicate with this name and arguments
+    @staticmethod
+    def make(name, left: Symbol, right: Symbol):
+        key = (Predicate, name, left, right)
+        pred = _NODE_CACHE.get(key)
+        if pred is None:
+            pred = _NODE_CACHE[key] = Predicate(name, left, right)
+        return pred
 
     def isQuantified(self):
         return isinstance(self._leftVar, Constant) and isinstance(self._rightVar, Constant)
 
     def __eq__(self, other):
-        return self.getLeftVar() == other.getLeftVar() and self.getRightVar() == other.getRightVar()
+        return isinstance(other, Predicate) and self.name == other.name \
+            and self._leftVar == other._leftVar and self._rightVar == other._rightVar
+
+    def __hash__(self):
+        return self._hash
 
     def __str__(self):
         return self.name + "(" + str(self.getLeftVar()) + "," + str(self.getRightVar()) + ")"
 
 
 class Formula(Symbol):
-    _children: []
+    __slots__ = ('_left', '_right', '_shash', '_str')
+    _left: Symbol
+    _right: Symbol
+    _shash: int
+    _str: str
 
     def __init__(self, name: str, left=None, right=None):
         super(Formula, self).__init__(name)
-        self._children = [left, right]
+        self._left = left
+        self._right = right
+        self._str = None
+        # structural hash of the subtree, computed once from the children's hashes
+        self._shash = hash((type(self), name, hash(left), hash(right)))
 
     def getLeft(self):
-        return self._children[0]
+        return self._left
 
     def getRight(self):
-        return self._children[1]
-
-    def setLeft(self, child):
-        self._children[0] = child
-
-    def setRight(self, child):
-        self._children[1] = child
+        return self._right
+
+    # the shared formula of this class over the given parts: the operands of a connective,
+    # or the variable and body of a quantifier; parts are compared by identity, so nodes are
+    # only shared when built bottom-up through make within the same input line, and must not
+    # be modified afterwards
+    @classmethod
+    def make(cls, first, second=None):
+        key = (cls, id(first), id(second))
+        fm = _NODE_CACHE.get(key)
+        if fm is None:
+            fm = _NODE_CACHE[key] = cls(first) if second is None else cls(first, second)
+        return fm
 
     def isBinary(self):
-        return self.getLeft() is not None and self.getRight() is not None
+        return self._left is not None and self._right is not None
 
-    def expand(self):
-        return self
+    # Replaces the free occurrences of var by const, rebuilding the tree through make.
+    # The tree is walked with an explicit stack, as in toNNF: a node is visited once to schedule
+    # its children, and once more to build the result from the children's results.
+    # A quantifier over var binds it, so its subtree is kept as it is.
+    def substitute(self, var, const):
+        results = []
+        stack = [(self, False)]
+        while stack:
+            node, built = stack.pop()
+            if not isinstance(node, Formula):  # atom
+                results.append(node.substitute(var, const))
+            elif not built:
+                if node.isBinary():
+                    stack.append((node, True))
+                    stack.append((node._right, False))
+                    stack.append((node._left, False))
+                elif isinstance(node, NotFormula) or node.getVariable() != var:
+                    stack.append((node, True))
+                    stack.append((node._left, False))
+                else:
+                    results.append(node)
+            elif node.isBinary():
+                right = results.pop()
+                results.append(type(node).make(results.pop(), right))
+            elif isinstance(node, NotFormula):
+                results.append(NotFormula.make(results.pop()))
+            else:
+                results.append(type(node).make(node.getVariable(), results.pop()))
+        return results.pop()
 
-    def canExpand(self):
-        return isinstance(self, NotFormula) or isinstance(self, ImpliesFormula)
+    def __hash__(self):
+        return self._shash
 
+    # compares the trees pair by pair with an explicit stack; hash-consed subtrees are usually
+    # identical, and different structural hashes rule out equality without walking any further
     def __eq__(self, other):
-        result = True
-        result = result and self.name == other.name  # is name same
-        result = result and type(self) is type(other)  # is same class
-        if isinstance(self, Formula) and isinstance(other, Formula):
-            result = result and self.getLeft() == other.getLeft()  # is same left child
-            result = result and self.getRight() == other.getRight()  # is same right child
-        return result
+        stack = [(self, other)]
+        while stack:
+            a, b = stack.pop()
+            if a is b:
+                continue
+            if not isinstance(a, Formula):  # atoms
+                if a != b:
+                    return False
+            elif isinstance(b, Formula) and a._shash == b._shash \
+                    and type(a) is type(b) and a.name == b.name:
+                stack.append((a._right, b._right))
+                stack.append((a._left, b._left))
+            else:
+                return False
+        return True
 
+    # walks the tree with an explicit stack and joins the fragments once,
+    # rather than concatenating a new string for every subtree;
+    # the result is kept on the node, and subtrees printed before are reused
     def __str__(self):
-        if isinstance(self, NotFormula):
-            return FormulaSymbol.Not + str(self.getLeft())
-        if isinstance(self, ExistFormula):
-            return FormulaSymbol.Exist + str(self.getVariable()) + str(self.getLeft())
-        if isinstance(self, ForAllFormula):
-            return FormulaSymbol.All + str(self.getVariable()) + str(self.getLeft())
-        if isinstance(self, Proposition) or isinstance(self, Variable) \
-                or isinstance(self, Constant) or isinstance(self, Predicate):
-            return str(self)
-        return "(" + str(self.getLeft()) + self.name + str(self.getRight()) + ")"
+        if self._str is not None:
+            return self._str
+        out = []
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if isinstance(node, str):
+                out.append(node)
+            elif isinstance(node, Formula):
+                if node._str is not None:
+                    out.append(node._str)
+                else:
+                    node._pushTokens(stack)
+            else:  # propositions and predicates
+                out.append(str(node))
+        self._str = "".join(out)
+        return self._str
+
+    # push the fragments of this node onto the printing stack, last fragment first
+    def _pushTokens(self, stack):
+        stack.extend((")", self._right, self.name, self._left, "("))
 
 
 class AndFormula(Formula):
+    __slots__ = ()
+    rule = TableauRule.ALPHA
 
     def __init__(self, left=None, right=None):
         super().__init__(FormulaSymbol.And, left, right)
 
-    def substitute(self, var, const):
-        left = self.getLeft().substitute(var, const)
-        right = self.getRight().substitute(var, const)
-        return AndFormula(left, right)
-
 
 class OrFormula(Formula):
+    __slots__ = ()
+    rule = TableauRule.BETA
 
     def __init__(self, left=None, right=None):
         super().__init__(FormulaSymbol.Or, left, right)
 
-    def substitute(self, var, const):
-        left = self.getLeft().substitute(var, const)
-        right = self.getRight().substitute(var, const)
-        return OrFormula(left, right)
-
 
 class ImpliesFormula(Formula):
+    __slots__ = ()
 
     def __init__(self, left=None, right=None):
         super().__init__(FormulaSymbol.Implies, left, right)
 
-    def expand(self) -> Formula:
-        return OrFormula(NotFormula(self.getLeft()), self.getRight())
-
-    def substitute(self, var, const):
-        left = self.getLeft().substitute(var, const)
-        right = self.getRight().substitute(var, const)
-        return ImpliesFormula(left, right)
-
 
 class NotFormula(Formula):
+    __slots__ = ()
+    # negations only sit on atoms once the formula is in negation normal form
+    rule = TableauRule.LITERAL
 
     def __init__(self, formula=None):
         super().__init__(FormulaSymbol.Not, formula)
 
-    def expand(self) -> Formula:
-        formula = self.getLeft()
-        if isinstance(formula, AndFormula):  # ~(A & B) = ~A | ~B
-            return OrFormula(NotFormula(formula.getLeft()), NotFormula(formula.getRight()))
-        elif isinstance(formula, OrFormula):  # ~(A | B) = ~A & ~B
-            return AndFormula(NotFormula(formula.getLeft()), NotFormula(formula.getRight()))
-        elif isinstance(formula, NotFormula):  # ~~A = A (where A is expanded form)
-            result = formula.getLeft()
-            if isinstance(result, Formula) and result.canExpand():
-                return result.expand()
-            else:
-                return result
-        elif isinstance(formula, ImpliesFormula):  # ~(A -> B) = A & ~B
-            return AndFormula(formula.getLeft(), NotFormula(formula.getRight()))
-        elif isinstance(formula, ForAllFormula):  # -Ax = E-x
-            return ExistFormula(formula.getVariable(), NotFormula(formula.getLeft()))
-        elif isinstance(formula, ExistFormula):  # -Ex = A-x
-            return ForAllFormula(formula.getVariable(), NotFormula(formula.getLeft()))
-        else:  # ~A = ~A
-            return self
-
-    def substitute(self, var, const):
-        left = self.getLeft().substitute(var, const)
-        return NotFormula(left)
+    def _pushTokens(self, stack):
+        stack.extend((self._left, FormulaSymbol.Not))
 
 
 class ForAllFormula(Formula):
+    __slots__ = ('_var',)
+    rule = TableauRule.GAMMA
     _var: Variable
 
     def __init__(self, var: Variable, formula: Symbol):
@@ -222,15 +335,13 @@ class ForAllFormula(Formula):
     def getVariable(self):
         return self._var
 
-    def substitute(self, v: Variable, c: Constant):
-        if self._var != v:
-            fm = self.getLeft().substitute(v, c)
-            return ForAllFormula(self.getVariable(), fm)
-        else:
-            return self
+    def _pushTokens(self, stack):
+        stack.extend((self._left, self._var.name, FormulaSymbol.All))
 
 
 class ExistFormula(Formula):
+    __slots__ = ('_var',)
+    rule = TableauRule.DELTA
     _var: Variable
 
     def __init__(self, var: Variable, formula: Symbol):
@@ -240,12 +351,56 @@ class ExistFormula(Formula):
     def getVariable(self):
         return self._var
 
-    def substitute(self, v, c):
-        if self._var != v:
-            fm = self.getLeft().substitute(v, c)
-            return ExistFormula(self.getVariable(), fm)
+    def _pushTokens(self, stack):
+        stack.extend((self._left, self._var.name, FormulaSymbol.Exist))
+
+
+# Rewrites fm (negated if asked) into negation normal form, where negations only sit on atoms.
+# The tableau runs on this form only, so it never has to expand negations or implications;
+# parse keeps the formula as written for the PARSE output.
+# The tree is walked with an explicit stack: a node is visited once to schedule its children
+# with their negation flags, and once more to build the result from the children's results.
+def toNNF(fm: Symbol, negated=False) -> Symbol:
+    results = []
+    stack = [(fm, negated, False)]
+    while stack:
+        node, negated, built = stack.pop()
+        rule = _PUSH_NEG.get(type(node))
+
+        if rule is None:
+            if isinstance(node, NotFormula):  # ~~A = A
+                stack.append((node.getLeft(), not negated, False))
+            else:  # atom
+                results.append(NotFormula.make(node) if negated else node)
+
+        elif not built:
+            stack.append((node, negated, True))
+            if node.isBinary():
+                stack.append((node.getRight(), negated, False))
+                stack.append((node.getLeft(), negated != rule[2], False))
+            else:
+                stack.append((node.getLeft(), negated, False))
+
         else:
-            return self
+            cls = rule[1] if negated else rule[0]
+            if node.isBinary():
+                right = results.pop()
+                results.append(cls.make(results.pop(), right))
+            else:
+                results.append(cls.make(node.getVariable(), results.pop()))
+
+    return results.pop()
+
+
+# rules of toNNF, keyed by the class of the formula: the class to build as is, the class to build
+# under a negation (the dual), and whether the left child flips its negation
+_PUSH_NEG = {
+    AndFormula: (AndFormula, OrFormula, False),  # ~(A & B) = ~A | ~B
+    OrFormula: (OrFormula, AndFormula, False),  # ~(A | B) = ~A & ~B
+    ImpliesFormula: (OrFormula, AndFormula, True),  # A -> B = ~A | B, ~(A -> B) = A & ~B
+    ForAllFormula: (ForAllFormula, ExistFormula, False),  # -Ax = E-x
+    ExistFormula: (ExistFormula, ForAllFormula, False),  # -Ex = A-x
+}
 
 
 class ParseException(Exception):
@@ -259,132 +414,156 @@ class TableauException(Exception):
 
 
 class Parser:
+    # the read position is threaded through the parse methods as a local index,
+    # each of them returns the parsed formula together with the position after it
     def __init__(self):
         self._isFirstOrder = False
-        self._tokens = []
-        self._p = 0
-        self._temp_p = 0
+
+    # prepare the parser for the next formula
+    def reset(self):
+        self._isFirstOrder = False
 
     def isFirstOrderFormula(self):
         return self._isFirstOrder
 
-    def hasNext(self):
-        return self._p != len(self._tokens)
+    @staticmethod
+    def eatNext(s: str, i: int, symbol: str) -> int:
+        if i < len(s) and s[i] == symbol:
+            return i + 1
+        Parser._syntaxError(s, i, symbol)
 
-    def readNext(self):
-        if self.hasNext():
-            value = self._tokens[self._p]
-            self._p += 1
-            self._temp_p = self._p
-            return value
-        return None
+    # slow path of the checks above, the message is only built for malformed input
+    @staticmethod
+    def _syntaxError(s: str, i: int, symbol: str):
+        actual = s[i] if i < len(s) else "end of input"
+        raise ParseException("Syntax Error: Expecting " + symbol + " actual " + actual)
 
-    def peekNext(self):
-        if self.hasNext():
-            value = self._tokens[self._temp_p]
-            self._temp_p += 1
-            return value
-        return None
+    def parse(self, formula: str) -> Symbol:
+        # every token is a single character, so the string is indexed directly
+        tree, i = self.parseFormula(formula, 0)
+        if i != len(formula):
+            raise ParseException("Unexpected token " + formula[i])
+        return tree
+
+    # Parses the formula starting at i without recursing: operators whose operand is still being
+    # read wait on the pending stack, and every finished formula is handed down that stack until
+    # an operator needs another operand (the right side of a binary connective) or the stack is empty.
+    def parseFormula(self, s: str, i: int):
+        pending = []
+        n = len(s)
+        while True:
+            first = s[i] if i < n else None
+            kind = _TOKEN_KIND.get(first)
+
+            # propositional logic base case
+            if kind == TokenKind.PROP:
+                node = _PROPS[first]
+                i += 1
+
+            # negation
+            elif kind == TokenKind.NOT:
+                pending.append((_WAIT_NOT, None))
+                i += 1
+                continue
+
+            # parentheses
+            # the only child inside parentheses is binary operation
+            elif kind == TokenKind.OPEN:
+                pending.append((_WAIT_LEFT, None))
+                i += 1
+                continue
+
+            # first order logic base case
+            elif kind == TokenKind.PRED:
+                self._isFirstOrder = True
+                # a predicate always spans the six characters P(x,y), so one length check covers them
+                if i + 5 >= n:
+                    raise ParseException("Incomplete predicate " + s[i:])
+                if s[i + 1] != "(":
+                    Parser._syntaxError(s, i + 1, "(")
+                var1 = s[i + 2]
+                if var1 not in _VAR_CHARS:
+                    raise ParseException("var1 is not a variable")
+                if s[i + 3] != ",":
+                    Parser._syntaxError(s, i + 3, ",")
+                var2 = s[i + 4]
+                if var2 not in _VAR_CHARS:
+                    raise ParseException("var2 is not a variable")
+                if s[i + 5] != ")":
+                    Parser._syntaxError(s, i + 5, ")")
+                node = Predicate.make(first, _VARS[var1], _VARS[var2])
+                i += 6
+
+            # existentially quantified
+            elif kind == TokenKind.EXIST:
+                self._isFirstOrder = True
+                var = s[i + 1] if i + 1 < n else None
+                if var not in _VAR_CHARS:
+                    raise ParseException("existentially quantifier requires a variable")
+                pending.append((_WAIT_EXIST, _VARS[var]))
+                i += 2
+                continue
+
+            # universally quantified
+            elif kind == TokenKind.ALL:
+                self._isFirstOrder = True
+                var = s[i + 1] if i + 1 < n else None
+                if var not in _VAR_CHARS:
+                    raise ParseException("universally quantifier requires a variable")
+                pending.append((_WAIT_ALL, _VARS[var]))
+                i += 2
+                continue
+
+            # empty formula
+            elif first is None:
+                raise ParseException("Unexpected empty sequence")
+
+            # undefined rule
+            else:
+                raise ParseException("Undefined rule, unexpected token" + first)
+
+            # hand the finished formula to the operators waiting for it
+            while pending:
+                waiting, arg = pending.pop()
+                if waiting == _WAIT_NOT:
+                    node = NotFormula.make(node)
+                elif waiting == _WAIT_EXIST:
+                    node = ExistFormula.make(arg, node)
+                elif waiting == _WAIT_ALL:
+                    node = ForAllFormula.make(arg, node)
+                # left side of a binary connective, read the connective and go on with the right side
+                elif waiting == _WAIT_LEFT:
+                    op = s[i] if i < n else None
+                    pending.append((_WAIT_RIGHT, (node, op)))
+                    i += 1
+                    break
+                else:
+                    left, op = arg
+                    connective = _CONNECTIVES.get(op)
+                    if connective is None:
+                        raise ParseException("Unrecognized operator " + str(op))
+                    node = connective.make(left, node)
+                    i = self.eatNext(s, i, ")")
+            else:
+                return node, i
 
-    def eatNext(self, symbol: str):
-        actual = self.readNext()
-        if actual != symbol:
-            raise ParseException("Syntax Error: Expecting " + symbol + " actual " + actual)
-        return symbol
 
-    def assertEnd(self):
-        if self.hasNext():
-            value = self.readNext()
-            raise ParseException("Unexpected token " + value)
+# operators on the pending stack of Parser.parseFormula, waiting for the formula parsed next;
+# module constants rather than class attributes, they are read for every token
+_WAIT_NOT = 0
+_WAIT_EXIST = 1
+_WAIT_ALL = 2
+_WAIT_LEFT = 3
+_WAIT_RIGHT = 4
 
-    def parse(self, formula: str) -> Symbol:
-        # produces tokens
-        self._tokens = list(formula)
-
-        # building formula tree
-        formula = self.parseFormula()
-        self.assertEnd()
-
-        return formula
-
-    def parseFormula(self) -> Symbol:
-        first = self.peekNext()
-
-        # empty formula
-        if first is None:
-            raise ParseException("Unexpected empty sequence")
-
-        # first order logic base case
-        elif Predicate.isPredChar(first):
-            self._isFirstOrder = True
-            name = self.readNext()
-            self.eatNext("(")
-            var1 = self.readNext()
-            if not Variable.isVar(var1):
-                raise ParseException("var1 is not a variable")
-            self.eatNext(",")
-            var2 = self.readNext()
-            if not Variable.isVar(var2):
-                raise ParseException("var2 is not a variable")
-            self.eatNext(")")
-            return Predicate(name, Variable(var1), Variable(var2))
-
-        # propositional logic base case
-        elif Proposition.isProp(first):
-            self.eatNext(first)
-            return Proposition(first)
-
-        # negation
-        elif first == FormulaSymbol.Not:
-            self.eatNext(FormulaSymbol.Not)
-            formula = self.parseFormula()
-            return NotFormula(formula)
-
-        # existentially quantified
-        elif first == FormulaSymbol.Exist:
-            self._isFirstOrder = True
-            self.eatNext(FormulaSymbol.Exist)
-            var = self.readNext()
-            if not Variable.isVar(var):
-                raise ParseException("existentially quantifier requires a variable")
-            formula = self.parseFormula()
-            return ExistFormula(Variable(var), formula)
-
-        # universally quantified
-        elif first == FormulaSymbol.All:
-            self._isFirstOrder = True
-            self.eatNext(FormulaSymbol.All)
-            var = self.readNext()
-            if not Variable.isVar(var):
-                raise ParseException("universally quantifier requires a variable")
-            formula = self.parseFormula()
-            return ForAllFormula(Variable(var), formula)
-
-        # parentheses
-        # the only child inside parentheses is binary operation
-        elif first == "(":
-            self.eatNext("(")
-            leftFormula = self.parseBinary()
-            self.eatNext(")")
-            return leftFormula
-
-        # undefined rule
-        else:
-            raise ParseException("Undefined rule, unexpected token" + first)
-
-    def parseBinary(self):
-        left = self.parseFormula()
-        op = self.readNext()
-        right = self.parseFormula()
-
-        if op == FormulaSymbol.And:
-            return AndFormula(left, right)
-        elif op == FormulaSymbol.Or:
-            return OrFormula(left, right)
-        elif op == FormulaSymbol.Implies:
-            return ImpliesFormula(left, right)
-        else:
-            raise ParseException("Unrecognized operator " + op)
+# the characters a formula can start with, mapped to their token kind
+_TOKEN_KIND = {FormulaSymbol.Not: TokenKind.NOT, FormulaSymbol.Exist: TokenKind.EXIST,
+               FormulaSymbol.All: TokenKind.ALL, "(": TokenKind.OPEN}
+_TOKEN_KIND.update(dict.fromkeys(_PROP_CHARS, TokenKind.PROP))
+_TOKEN_KIND.update(dict.fromkeys(_PRED_CHARS, TokenKind.PRED))
+
+# binary connectives, mapped to the formula class they build
+_CONNECTIVES = {FormulaSymbol.And: AndFormula, FormulaSymbol.Or: OrFormula, FormulaSymbol.Implies: ImpliesFormula}
 
 
 class Result:
@@ -393,6 +572,8 @@ class Result:
     NOT_SATISFIABLE = 0
     MAY_SATISFIABLE = 2
 
+    __slots__ = ('result',)
+
     def __init__(self, result):
         self.result = result
 
@@ -402,18 +583,25 @@ class Result:
     def deterministic(self):
         return self.result != Result.MAY_SATISFIABLE
 
+    # result of a disjunction: satisfiable if either side is, otherwise undecided if either side is
     @staticmethod
     def checkSAT(self, other):
-        if self.result == Result.SATISFIABLE or other.result == Result.SATISFIABLE:
-            return Result(Result.SATISFIABLE)
-        if self.result == Result.MAY_SATISFIABLE or other.result == Result.MAY_SATISFIABLE:
-            return Result(Result.MAY_SATISFIABLE)
-        if self.result == Result.NOT_SATISFIABLE and other.result == Result.NOT_SATISFIABLE:
-            return Result(Result.NOT_SATISFIABLE)
-        raise TableauException("Uncaught logic or evaluation, left: " + str(self) + " right: " + str(other))
+        return _RESULT_OR[self.result][other.result]
+
+
+# one shared Result per outcome, indexed by its code
+_RESULTS = [Result(Result.NOT_SATISFIABLE), Result(Result.SATISFIABLE), Result(Result.MAY_SATISFIABLE)]
+_RESULT_OR = [
+    # right: not satisfiable, satisfiable, may be satisfiable
+    [_RESULTS[0], _RESULTS[1], _RESULTS[2]],  # left: not satisfiable
+    [_RESULTS[1], _RESULTS[1], _RESULTS[1]],  # left: satisfiable
+    [_RESULTS[2], _RESULTS[1], _RESULTS[2]],  # left: may be satisfiable
+]
 
 
 class ConstantSupplier:
+    __slots__ = ('_constants', '_i')
+
     def __init__(self, consts):
         self._constants: [Constant] = consts
         self._i = 0
@@ -429,54 +617,122 @@ class ConstantSupplier:
         return None
 
 
+class LiteralSet:
+    __slots__ = ('symbols', '_bits', '_positives', '_negatives', '_conflict')
+
+    def __init__(self):
+        # literals in the order they were added to the branch
+        self.symbols: [Symbol] = []
+        # the single-bit mask of each atom met in this proof, numbered from the lowest bit up,
+        # so the masks stay as wide as the atoms of the formula being proven
+        self._bits = {}
+        # bitmasks of the atoms asserted and of the atoms negated along the branch
+        self._positives = 0
+        self._negatives = 0
+        # the negation which closes the branch, if any
+        self._conflict = None
+
+    # add a literal and report whether the branch is now contradictory
+    def add(self, literal: Symbol) -> bool:
+        self.symbols.append(literal)
+        if isinstance(literal, NotFormula):
+            bit = self._bit(literal.getLeft())
+            self._negatives |= bit
+            if self._positives & bit and self._conflict is None:
+                self._conflict = literal
+        else:
+            bit = self._bit(literal)
+            self._positives |= bit
+            if self._negatives & bit and self._conflict is None:
+                # equal to the negation found on the branch, only reported in the trace
+                self._conflict = NotFormula.make(literal)
+        return self._conflict is not None
+
+    # equal atoms share their bit; bits are never taken back by rollback, which only restores the masks
+    def _bit(self, atom):
+        bit = self._bits.get(atom)
+        if bit is None:
+            bit = self._bits[atom] = 1 << len(self._bits)
+        return bit
+
+    def getConflict(self):
+        return self._conflict
+
+    # the literals of the branch as a hashable key: which atoms are asserted, which are negated,
+    # and whether the branch is still open
+    def key(self):
+        return self._positives, self._negatives, self._conflict is None
+
+    def savepoint(self):
+        return len(self.symbols), self._positives, self._negatives, self._conflict
+
+    # forget every literal added since the savepoint
+    def rollback(self, savepoint):
+        size, self._positives, self._negatives, self._conflict = savepoint
+        del self.symbols[size:]
+
+
 class PriorityQueue:
-    def __init__(self, fms=None, syms=None, consts=None):
-        if syms is None:
-            syms = []
-        if fms is None:
-            fms = []
-        if consts is None:
-            consts = []
-
-        # intermediate formula expansions
-        self.formulas: [Formula] = fms
+    __slots__ = ('_front', '_back', 'symbols', 'consts')
+
+    def __init__(self):
+        # intermediate formula expansions, kept as a persistent queue of (formula, rest) cells
+        # so that a savepoint only needs the two ends: _front holds the head in order, _back the tail reversed
+        self._front = None
+        self._back = None
         # terminal terms along the proof trace
-        self.symbols: [Symbol] = syms
+        self.symbols: LiteralSet = LiteralSet()
         # constants introduced
-        self.consts: [Constant] = consts
+        self.consts: [Constant] = []
 
+    # formulas are in negation normal form (see toNNF), so no rewriting is needed before queueing
     def addFormula(self, fm: Symbol):
-        # we expand in advance so that we have apply the rule directly after retrieving formula
-        if isinstance(fm, Formula) and fm.canExpand():
-            fm = fm.expand()
-
-        if fm.isSymbol():
-            self.symbols.append(fm)
+        rule = fm.rule
+        if rule == TableauRule.LITERAL:
+            self.symbols.add(fm)
+        # favor Existential formula, because it can introduce new variable
+        # favor AND formula, to increase tableau efficiency
+        elif rule == TableauRule.DELTA or rule == TableauRule.ALPHA:
+            self._front = (fm, self._front)
         else:
-            # favor Existential formula, because it can introduce new variable
-            if isinstance(fm, ExistFormula):
-                self.formulas.insert(0, fm)
-            # favor AND formula, to increase tableau efficiency
-            elif isinstance(fm, AndFormula):
-                self.formulas.insert(0, fm)
-            else:
-                self.formulas.append(fm)
+            self._back = (fm, self._back)
 
     def getFormula(self):
-        if len(self.formulas) == 0:
-            return None
-        return self.formulas.pop(0)
+        if self._front is None:
+            # move the reversed tail over to the head
+            back = self._back
+            while back is not None:
+                self._front = (back[0], self._front)
+                back = back[1]
+            self._back = None
+            if self._front is None:
+                return None
+        fm, self._front = self._front
+        return fm
 
     def getRemainingSymbols(self):
-        return self.symbols
+        return self.symbols.symbols
 
     def checkContradiction(self):
-        for symbol in self.symbols:
-            if isinstance(symbol, NotFormula):
-                for compare in self.symbols:
-                    if compare == symbol.getLeft():
-                        return symbol
-        return None
+        return self.symbols.getConflict()
+
+    # the rest of the branch as a hashable key: the ids of the pending formulas in order,
+    # the literal key, and the number of constants (always 'a', 'b', ... in order).
+    # The ids are stable: the node pool and the tree being proven pin the formulas for the whole proof.
+    # Building the key walks the whole queue, so it costs O(pending formulas) per beta expansion.
+    def sequentKey(self):
+        pending = []
+        cell = self._front
+        while cell is not None:
+            pending.append(id(cell[0]))
+            cell = cell[1]
+        tail = []
+        cell = self._back
+        while cell is not None:
+            tail.append(id(cell[0]))
+            cell = cell[1]
+        pending.extend(reversed(tail))
+        return (tuple(pending),) + self.symbols.key() + (len(self.consts),)
 
     def getSupplier(self):
         return ConstantSupplier(self.consts)
@@ -484,145 +740,247 @@ class PriorityQueue:
     # try to introduce new constant followed by Ex expansion
     # when it has introduced more than 10 constants
     # it will terminate and return None
+    # constants are only added here, in the order of _CONSTS, so the next one follows from the count
     def introduceConstant(self):
-        for i in range(10):
-            newConstChar = chr(ord('a') + i)
-            duplicate = False
-            for exC in self.consts:
-                if exC.name == newConstChar:
-                    duplicate = True
-                    break
-            if not duplicate:
-                newConst = Constant(newConstChar)
-                self.consts.append(newConst)
-                return newConst
-        return None
+        count = len(self.consts)
+        if count == len(_CONSTS):
+            return None
+        newConst = _CONSTS[count]
+        self.consts.append(newConst)
+        return newConst
 
-    def copy(self):
-        return PriorityQueue(self.formulas.copy(), self.symbols.copy(), self.consts.copy())
+    # the branches of a beta expansion run one after the other on the same queue,
+    # which is rolled back to the savepoint taken before each of them
+    def savepoint(self):
+        return self._front, self._back, self.symbols.savepoint(), len(self.consts)
+
+    def rollback(self, savepoint):
+        self._front, self._back, symbols, size = savepoint
+        self.symbols.rollback(symbols)
+        del self.consts[size:]
 
 
 class ProofMachine:
-    def __init__(self):
+    # frames of the explicit stack, waiting for the result of a branch
+    _BETA_LEFT = 0
+    _BETA_RIGHT = 1
+    _GAMMA = 2
+
+    # number of results kept before the memo of proven formulas is emptied
+    _RESULTS_SIZE = 4096
+
+    # the proof trace is only kept when record is set, it is not needed to decide satisfiability
+    def __init__(self, record=False):
         self._process = []
         self._expand_id = 0
+        self._record = record
+        if not record:
+            self._log = self._skipLog
+        # results of the formulas proven so far, as id(formula) -> (formula, result), the entry keeps
+        # the formula alive so its id is not reused; a repeated input line gets the same tree from parse
+        self._results = {}
+
+    # clear the trace of the previous proof
+    def reset(self):
+        self._process.clear()
+        self._expand_id = 0
 
     def SAT(self, t: Formula) -> Result:
-        return self._isFormulaClosed(t, PriorityQueue(), "", "")
-
-    def _alpha(self, fm: AndFormula, queue: PriorityQueue, prefix: str, childrenPrefix: str) -> Result:
-        self._process.append(prefix + str(fm))
+        # a recorded proof has to be run again to produce its trace
+        if self._record:
+            return self._run(toNNF(t), PriorityQueue())
+        cached = self._results.get(id(t))
+        if cached is None:
+            if len(self._results) >= self._RESULTS_SIZE:
+                self._results.clear()
+            cached = self._results[id(t)] = (t, self._run(toNNF(t), PriorityQueue()))
+        return cached[1]
+
+    # Runs the tableau as a loop over an explicit stack instead of recursing per expansion.
+    # fm is the formula to expand next, or None when the next formula comes from the queue.
+    # Trace prefixes are (parent, template, expand id) chains, rendered only by getOutput.
+    def _run(self, fm: Symbol, queue: PriorityQueue) -> Result:
+        # trace prefixes are only built when the trace is recorded, otherwise they stay None
+        record = self._record
+        prefix = None
+        childrenPrefix = None
+        stack = []
+        result = None
+        # outcomes of the beta expansions done so far, keyed by the disjunction and the sequentKey of its
+        # branch; a beta expansion rolls its queue back, so its outcome depends on nothing else.
+        # Not used while recording, the trace has to show every expansion
+        sequents = {}
+
+        while True:
+            if result is not None:
+                if not stack:
+                    return result
+                frame = stack.pop()
+                kind = frame[0]
+
+                # left branch of a beta expansion is done, continue with the right one
+                if kind == ProofMachine._BETA_LEFT:
+                    _, betaFm, queue, savepoint, betaPrefix, key = frame
+                    queue.rollback(savepoint)
+                    # an open left branch already makes the disjunction satisfiable
+                    if result.result == Result.SATISFIABLE:
+                        if key is not None:
+                            sequents[key] = result
+                        continue
+                    stack.append((ProofMachine._BETA_RIGHT, result, queue, savepoint, key))
+                    fm = betaFm.getRight()
+                    prefix = childrenPrefix = betaPrefix
+                    result = None
+
+                elif kind == ProofMachine._BETA_RIGHT:
+                    _, leftResult, betaQueue, savepoint, key = frame
+                    betaQueue.rollback(savepoint)
+                    result = Result.checkSAT(leftResult, result)
+                    if key is not None:
+                        sequents[key] = result
+
+                # gamma expansion continues on the same queue with the next constant
+                elif result.result != Result.NOT_SATISFIABLE:
+                    _, gammaFm, queue, constsSupplier, prefix, childrenPrefix = frame
+                    if constsSupplier.canConsume():
+                        c = constsSupplier.consume()
+                        queue.addFormula(gammaFm.getLeft().substitute(gammaFm.getVariable(), c))
+                        stack.append(frame)
+                        fm = None
+                        result = None
+                continue
+
+            # take the next formula from the branch
+            if fm is None:
+                symbol = queue.checkContradiction()
+                if symbol is not None:
+                    self._log(prefix, "├── {0}", symbol)
+                    self._log(prefix, "Close because {0} contradict with {1}", symbol, symbol.getLeft())
+                    # the negation result leads to contradiction, hence this branch is satisfiable
+                    result = _RESULTS[Result.NOT_SATISFIABLE]
+                    continue
+
+                fm = queue.getFormula()
+                if fm is None:
+                    if record:
+                        self._log(prefix, "├── ")
+                        self._log(prefix, "Branch is Open for variables {0}", list(queue.getRemainingSymbols()))
+                    # the negation result stands in this branch, hench this branch is not satisfiable
+                    result = _RESULTS[Result.SATISFIABLE]
+                    continue
+
+            rule = fm.rule
+
+            # if fm is a symbol
+            if rule == TableauRule.LITERAL:
+                # add to symbol queue
+                queue.addFormula(fm)
+
+            # alpha expansion
+            elif rule == TableauRule.ALPHA:
+                if record:
+                    prefix = (childrenPrefix, "│ alpha({0}) ", self._expand_id)
+                    childrenPrefix = (None, "│            ", None)
+                self._log(prefix, "{0}", fm)
+
+                left = fm.getLeft()
+                queue.addFormula(left)
+                self._log(prefix, "{0}", left)
+
+                right = fm.getRight()
+                queue.addFormula(right)
+                self._log(prefix, "{0}", right)
+
+                self._expand_id += 1
+
+            # beta expansion
+            elif rule == TableauRule.BETA:
+                if record:
+                    prefix = (childrenPrefix, "├─beta({0})─ ", self._expand_id)
+                    childrenPrefix = (childrenPrefix, "│            ", None)
+                self._log(prefix, "{0}", fm)
+                self._expand_id += 1
+
+                key = None
+                if not record:
+                    key = (id(fm), queue.sequentKey())
+                    known = sequents.get(key)
+                    if known is not None:
+                        result = known
+                        continue
+
+                stack.append((ProofMachine._BETA_LEFT, fm, queue, queue.savepoint(), childrenPrefix, key))
+                fm = fm.getLeft()
+                prefix = childrenPrefix
+                continue
+
+            # delta expansion (There exist...)
+            elif rule == TableauRule.DELTA:
+                if record:
+                    prefix = (childrenPrefix, "├─delta({0})─ ", self._expand_id)
+                    childrenPrefix = (childrenPrefix, "│            ", None)
+
+                constant = queue.introduceConstant()
+                if constant is None:
+                    result = _RESULTS[Result.MAY_SATISFIABLE]
+                    continue
+                # perform substitution
+                queue.addFormula(fm.getLeft().substitute(fm.getVariable(), constant))
 
-        left = fm.getLeft()
-        queue.addFormula(left)
-        self._process.append(prefix + str(left))
+            # gamma expansion (Forall ...)
+            elif rule == TableauRule.GAMMA:
+                if record:
+                    prefix = (childrenPrefix, "├─gamma({0})─ ", self._expand_id)
+                    childrenPrefix = (childrenPrefix, "│            ", None)
 
-        right = fm.getRight()
-        queue.addFormula(right)
-        self._process.append(prefix + str(right))
+                # do not tick the node ...
+                # which means that we need to try all possibilities
+                constsSupplier = queue.getSupplier()
 
-        self._expand_id += 1
-        return self._atom(queue, prefix, childrenPrefix)
+                # we have no constants at this moment
+                if not constsSupplier.canConsume():
+                    result = _RESULTS[Result.SATISFIABLE]
+                    continue
 
-    def _atom(self, queue: PriorityQueue, prefix: str, childrenPrefix: str) -> Result:
-        symbol = queue.checkContradiction()
-        if symbol is not None:
-            self._process.append(prefix + "├── " + str(symbol))
-            self._process.append(prefix + "Close because {0} contradict with {1}".format(symbol, symbol.getLeft()))
-            # the negation result leads to contradiction, hence this branch is satisfiable
-            return Result(Result.NOT_SATISFIABLE)
+                c = constsSupplier.consume()
+                queue.addFormula(fm.getLeft().substitute(fm.getVariable(), c))
+                stack.append((ProofMachine._GAMMA, fm, queue, constsSupplier, prefix, childrenPrefix))
 
-        fm = queue.getFormula()
-        if fm is None:
-            self._process.append(prefix + "├── ")
-            self._process.append(prefix + "Branch is Open for variables {0}"
-                                 .format([str(__s) for __s in queue.getRemainingSymbols()]))
-            # the negation result stands in this branch, hench this branch is not satisfiable
-            return Result(Result.SATISFIABLE)
-
-        return self._isFormulaClosed(fm, queue, prefix, childrenPrefix)
-
-    def _beta(self, fm: OrFormula, queue: PriorityQueue, prefix: str, childrenPrefix: str) -> Result:
-        self._process.append(prefix + str(fm))
-        self._expand_id += 1
-
-        leftCondition = self._isFormulaClosed(fm.getLeft(), queue.copy(), childrenPrefix, childrenPrefix)
-        rightCondition = self._isFormulaClosed(fm.getRight(), queue.copy(), childrenPrefix, childrenPrefix)
-        return Result.checkSAT(leftCondition, rightCondition)
-
-    def _isFormulaClosed(self, fm: Symbol, queue: PriorityQueue, prefix: str, childrenPrefix: str) -> Result:
-        if isinstance(fm, Formula) and fm.canExpand():
-            fm = fm.expand()
-
-        # if fm is a symbol
-        if fm.isSymbol():
-            # add to symbol queue
-            queue.addFormula(fm)
-            return self._atom(queue, prefix, childrenPrefix)
-
-        # alpha expansion
-        if isinstance(fm, AndFormula):
-            prefix = childrenPrefix + "│ alpha({0}) ".format(self._expand_id)
-            childrenPrefix = "│            ".format(self._expand_id)
-            return self._alpha(fm, queue, prefix, childrenPrefix)
-
-        # beta expansion
-        elif isinstance(fm, OrFormula):
-            prefix = childrenPrefix + "├─beta({0})─ ".format(self._expand_id)
-            childrenPrefix = childrenPrefix + "│            "
-            return self._beta(fm, queue, prefix, childrenPrefix)
-
-        # delta expansion (There exist...)
-        elif isinstance(fm, ExistFormula):
-            prefix = childrenPrefix + "├─delta({0})─ ".format(self._expand_id)
-            childrenPrefix = childrenPrefix + "│            "
-
-            constant = queue.introduceConstant()
-            if constant is None:
-                return Result(Result.MAY_SATISFIABLE)
             else:
-                # perform substitution
-                substFm = fm.getLeft().substitute(fm.getVariable(), constant)
-                queue.addFormula(substFm)
-                return self._atom(queue, prefix, childrenPrefix)
+                raise TableauException("Cannot evaluate formula " + str(fm))
 
-        # gamma expansion (Forall ...)
-        elif isinstance(fm, ForAllFormula):
-            prefix = childrenPrefix + "├─gamma({0})─ ".format(self._expand_id)
-            childrenPrefix = childrenPrefix + "│            "
+            fm = None
 
-            # do not tick the node ...
-            # which means that we need to try all possibilities
-
-            result = None
-            constsSupplier = queue.getSupplier()
-
-            while constsSupplier.canConsume():
-                c = constsSupplier.consume()
-                assert c is not None
+    # trace entries keep references to the formulas and are only rendered by getOutput
+    def _log(self, prefix, message: str, *args):
+        self._process.append((prefix, message, args))
 
-                substFm = fm.getLeft().substitute(fm.getVariable(), c)
-                queue.addFormula(substFm)
-                result = self._atom(queue, prefix, childrenPrefix)
-                if result.result == Result.NOT_SATISFIABLE:
-                    return result
-
-            # we have no constants at this moment
-            if result is None:
-                return Result(Result.SATISFIABLE)
-            else:
-                return result
+    @staticmethod
+    def _skipLog(prefix, message: str, *args):
+        pass
 
-        else:
-            raise TableauException("Cannot evaluate formula " + str(fm))
+    @staticmethod
+    def _renderPrefix(prefix) -> str:
+        parts = []
+        while prefix is not None:
+            prefix, template, expandId = prefix
+            parts.append(template.format(expandId))
+        return "".join(reversed(parts))
 
     def getOutput(self) -> str:
-        return "\n".join(self._process)
+        lines = []
+        for prefix, message, args in self._process:
+            args = [[str(s) for s in arg] if isinstance(arg, list) else arg for arg in args]
+            lines.append(self._renderPrefix(prefix) + message.format(*args))
+        return "\n".join(lines)
 
 
 # @MainCaller
 # central information process
 resultTree: Formula
+# reused for every input line
+callerParser = Parser()
+callerMachine = ProofMachine(record=debugFlag)
 
 
 class ParseOutputOption:
@@ -638,63 +996,106 @@ class ParseOutputOption:
 
 
 # Parse a formula, consult parseOutputs for return values.
+# parse trees are never modified after parsing, so a repeated input reuses its tree;
+# the memo is emptied once it holds _PARSE_CACHE_SIZE inputs (there is no functools here for an lru_cache)
+_PARSE_CACHE = {}
+_PARSE_CACHE_SIZE = 4096
+
+
 def parse(fm):
     global resultTree
+    # every input line starts a fresh node pool, trees kept by _PARSE_CACHE stay valid on their own
+    _NODE_CACHE.clear()
+    tree, option = _cachedParse(fm)
+    if tree is not None:
+        resultTree = tree
+    return option
+
+
+# the memoised (tree, parse output) of fm, parsed now if it is not in _PARSE_CACHE
+def _cachedParse(fm):
+    cached = _PARSE_CACHE.get(fm)
+    if cached is None:
+        if len(_PARSE_CACHE) >= _PARSE_CACHE_SIZE:
+            _PARSE_CACHE.clear()
+        cached = _PARSE_CACHE[fm] = _parseInput(fm)
+    return cached
+
+
+# parse fm and classify it, as (tree, parse output), the tree is None if fm is not a formula
+def _parseInput(fm):
     try:
-        callerParser = Parser()
-        resultTree = callerParser.parse(fm)
-        if not isinstance(resultTree, Formula):
-            if isinstance(resultTree, Proposition):
-                return ParseOutputOption.PROPOSITION
-            return ParseOutputOption.ATOM
-        if callerParser.isFirstOrderFormula():
-            if resultTree.isBinary():
-                return ParseOutputOption.BINARY_FIRST_ORDER_FORMULA
-            if isinstance(resultTree, ExistFormula):
-                return ParseOutputOption.EXISTENTIALLY_QUANTIFIED_FORMULA
-            if isinstance(resultTree, ForAllFormula):
-                return ParseOutputOption.UNIVERSAL_QUANTIFIED_FORMULA
-            if isinstance(resultTree, NotFormula):
-                return ParseOutputOption.FIRST_ORDER_FORMULA_NEGATION
-        else:
-            if isinstance(resultTree, NotFormula):
-                return ParseOutputOption.PROPOSITIONAL_FORMULA_NEGATION
-            if resultTree.isBinary():
-                return ParseOutputOption.BINARY_PROPOSITIONAL_FORMULA
-            return ParseOutputOption.PROPOSITION
+        callerParser.reset()
+        tree = callerParser.parse(fm)
+        return tree, _classify(tree, callerParser.isFirstOrderFormula())
     except ParseException:
-        return ParseOutputOption.NOT_FORMULA
+        return None, ParseOutputOption.NOT_FORMULA
+
+
+# the parse output for a parsed tree
+def _classify(tree, isFirstOrder):
+    if not isinstance(tree, Formula):
+        if isinstance(tree, Proposition):
+            return ParseOutputOption.PROPOSITION
+        return ParseOutputOption.ATOM
+    if isFirstOrder:
+        if tree.isBinary():
+            return ParseOutputOption.BINARY_FIRST_ORDER_FORMULA
+        if isinstance(tree, ExistFormula):
+            return ParseOutputOption.EXISTENTIALLY_QUANTIFIED_FORMULA
+        if isinstance(tree, ForAllFormula):
+            return ParseOutputOption.UNIVERSAL_QUANTIFIED_FORMULA
+        if isinstance(tree, NotFormula):
+            return ParseOutputOption.FIRST_ORDER_FORMULA_NEGATION
+    else:
+        if isinstance(tree, NotFormula):
+            return ParseOutputOption.PROPOSITIONAL_FORMULA_NEGATION
+        if tree.isBinary():
+            return ParseOutputOption.BINARY_PROPOSITIONAL_FORMULA
+        return ParseOutputOption.PROPOSITION
+
+
+# the tree of fm, or of the last parsed formula when fm is not given; the driver of skeleton.py
+# passes the input line, the template driver below does not.
+# Looking fm up leaves resultTree and the node pool of the current line as they are.
+def _parsedTree(fm):
+    if fm is None:
+        return resultTree
+    return _cachedParse(fm)[0]
 
 
 # Return the LHS of a binary connective formula
-def lhs():
-    return str(resultTree.getLeft())
+def lhs(fm=None):
+    return str(_parsedTree(fm).getLeft())
 
 
 # Return the connective symbol of a binary connective formula
-def con():
-    return resultTree.name
+def con(fm=None):
+    return _parsedTree(fm).name
 
 
 # Return the RHS symbol of a binary connective formula
-def rhs():
-    return str(resultTree.getRight())
+def rhs(fm=None):
+    return str(_parsedTree(fm).getRight())
 
 
 # You may choose to represent a theory as a set or a list
-# assumption theory is not required here
-# def theory(fm):  # initialise a theory with a single formula in it
-#     return None
+def theory(fm):  # initialise a theory with a single formula in it
+    return [_parsedTree(fm)]
 
 
-# check for satisfiability
-def sat():
-    machine = ProofMachine()
-    result = machine.SAT(resultTree)
+# check for satisfiability, of the last parsed formula when no tableau is given, otherwise of the
+# formula in the tableau's theory (the skeleton.py driver builds it as [theory(line)])
+def sat(tableau=None):
+    callerMachine.reset()
+    result = callerMachine.SAT(resultTree if tableau is None else tableau[0][0])
     if debugFlag:
-        print(machine.getOutput())
+        print(callerMachine.getOutput())
     # output 0 if not satisfiable, output 1 if satisfiable, output 2 if number of constants exceeds MAX_CONSTANTS
-    return str(result)
+    # the skeleton.py driver indexes satOutput with the code, the template driver below prints the text
+    if tableau is None:
+        return str(result)
+    return result.result
 
 
 # @Template Injected